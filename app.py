@@ -1,53 +1,479 @@
+import certifi
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import heapq
+import math
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
+import orjson
+import os
+import redis
 import requests
+import ssl
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader, MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+import threading
 import time
 
+
+class ORJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 GITHUB_API_URL = "https://api.github.com"
-CACHE = {}
+GITHUB_TIMEOUT = (2, 10)  # (connect, read) seconds
+GITHUB_RETRY_AFTER_MAX = 5  # longest Retry-After we will wait out in-request
+RATE_LIMIT = {"remaining": None, "reset": 0}  # last X-RateLimit-* seen
+CACHE = OrderedDict()  # least recently used first
+CACHE_LOCK = threading.Lock()
 CACHE_TTL = 300  # 5 minutes
+CLOCK = time.monotonic  # time source for cache deadlines; tests substitute it
+CACHE_MAX_SIZE = 1000
+CACHE_MAX_BYTES = 128_000_000
+CACHE_MAX_ENTRY_BYTES = 4_000_000  # larger payloads are served but not cached
+CACHE_BYTES = 0  # total len(data) of cached entries
+CACHE_STALE_TTL = 3600  # keep expired entries this long for ETag revalidation
+CACHE_PURGE_BATCH = 100
+EXPIRY_HEAP = []  # (dead_at, key), soonest first; may hold superseded items
+INFLIGHT = {}  # cache key -> Future of the GitHub fetch currently filling it
+INFLIGHT_WAIT_TIMEOUT = 60  # seconds a coalesced request waits for the leader
+PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+PREFETCH_MIN_REMAINING = 20  # leave this much GitHub quota for real requests
+PREFETCH_BACKOFF = 60  # seconds before retrying a failed/uncacheable prefetch
+PREFETCH_FAILED = {}  # cache key -> CLOCK() time before which not to prefetch
+PREFETCH_PENDING = set()  # cache keys submitted to PREFETCH_EXECUTOR, not done
+PREFETCH_MAX_PENDING = 32  # bounds the executor's otherwise unbounded queue
+
+# Optional shared L2 cache so every worker/pod benefits from one fetch.
+REDIS_URL = os.environ.get("REDIS_URL")
+REDIS = redis.Redis.from_url(
+    REDIS_URL, max_connections=50, socket_timeout=0.5
+) if REDIS_URL else None
+
+
+class GitHubRetry(Retry):
+    # Wait out a short Retry-After, but give up on a longer one: retrying
+    # sooner is certain to fail and still spends quota. Raising MaxRetryError
+    # with raise_on_status=False hands the response back to fetch_gists,
+    # which reports the real Retry-After as a 429.
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        if response is not None:
+            try:
+                retry_after = self.get_retry_after(response)
+            except InvalidHeader:
+                retry_after = None
+            if retry_after is not None and retry_after > GITHUB_RETRY_AFTER_MAX:
+                reason = ResponseError("Retry-After %s exceeds %s" % (
+                    retry_after, GITHUB_RETRY_AFTER_MAX))
+                raise MaxRetryError(_pool, url, reason)
+        return super().increment(
+            method, url, response, error, _pool, _stacktrace
+        )
+
+
+# Built once: otherwise urllib3 creates an SSL context and re-reads the CA
+# bundle for every new connection.
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+
+class GitHubAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = SSL_CONTEXT
+        super().init_poolmanager(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True:
+            # The CA bundle is already loaded into SSL_CONTEXT.
+            conn.ca_certs = None
+
+
+GITHUB_RETRY = GitHubRetry(
+    total=3,
+    backoff_factor=0.3,
+    backoff_jitter=0.5,
+    backoff_max=GITHUB_RETRY_AFTER_MAX,
+    status_forcelist=[429, 502, 503, 504],
+    raise_on_status=False,
+)
+
+# One pooled session for the whole process so keep-alive connections (and
+# their TLS handshakes) are reused across requests instead of per call.
+SESSION = requests.Session()
+SESSION.mount("https://", GitHubAdapter(
+    pool_connections=50,
+    pool_maxsize=100,
+    max_retries=GITHUB_RETRY,
+))
+
+
+class GitHubError(Exception):
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+CacheEntry = namedtuple("CacheEntry", ["data", "expires_at", "etag", "has_next"])
 
 
 def get_cached(key):
-    if key in CACHE:
-        data, timestamp = CACHE[key]
-        if time.time() - timestamp < CACHE_TTL:
-            return data
-        del CACHE[key]
-    return None
+    # Never locks: dict reads and move_to_end are atomic under the GIL, so
+    # hits never wait on writers. Expired entries are left in place for ETag
+    # revalidation and removed by purge_dead_entries once stale.
+    entry = CACHE.get(key)
+    if entry is None or CLOCK() >= entry.expires_at:
+        return None
+    try:
+        CACHE.move_to_end(key)
+    except KeyError:  # evicted concurrently
+        pass
+    return entry.data
 
 
-def set_cache(key, data):
-    CACHE[key] = (data, time.time())
+def discard_entry(key):
+    # Caller must hold CACHE_LOCK.
+    global CACHE_BYTES
+    entry = CACHE.pop(key, None)
+    if entry is not None:
+        CACHE_BYTES -= len(entry.data)
 
 
-@app.route("/<username>")
-def get_user_gists(username):
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 30, type=int)
+def purge_dead_entries(now):
+    # Caller must hold CACHE_LOCK. Only looks at heap items that are due, so
+    # the cost tracks the number of dead entries, not the cache size.
+    for _ in range(CACHE_PURGE_BATCH):
+        if not EXPIRY_HEAP or EXPIRY_HEAP[0][0] > now:
+            return
+        dead_at, key = heapq.heappop(EXPIRY_HEAP)
+        entry = CACHE.get(key)
+        # Skip items superseded by a later set_cache for the same key.
+        if entry is not None and entry.expires_at + CACHE_STALE_TTL == dead_at:
+            discard_entry(key)
+
+
+def set_cache(key, data, etag=None, has_next=False, ttl=None):
+    global CACHE_BYTES
+    now = CLOCK()
+    entry = CacheEntry(data, now + (CACHE_TTL if ttl is None else ttl), etag, has_next)
+    size = len(data)
+    with CACHE_LOCK:
+        purge_dead_entries(now)
+        discard_entry(key)
+        if size > CACHE_MAX_ENTRY_BYTES:
+            return
+        # Evict least recently used entries until both limits hold. popitem
+        # is atomic; iterating would race with get_cached's lock-free
+        # move_to_end and raise "OrderedDict mutated during iteration".
+        while CACHE and (
+            len(CACHE) >= CACHE_MAX_SIZE or CACHE_BYTES + size > CACHE_MAX_BYTES
+        ):
+            _, evicted = CACHE.popitem(last=False)
+            CACHE_BYTES -= len(evicted.data)
+        CACHE[key] = entry
+        CACHE_BYTES += size
+        heapq.heappush(EXPIRY_HEAP, (entry.expires_at + CACHE_STALE_TTL, key))
+        # Evictions and overwrites leave superseded items behind; rebuild
+        # from the live entries once they outnumber them, so the heap stays
+        # O(len(CACHE)) at amortized O(1) per insert. list() copies in one C
+        # call, so get_cached's lock-free move_to_end cannot interleave.
+        if len(EXPIRY_HEAP) > 2 * len(CACHE) + CACHE_PURGE_BATCH:
+            EXPIRY_HEAP[:] = [
+                (cached.expires_at + CACHE_STALE_TTL, cached_key)
+                for cached_key, cached in list(CACHE.items())
+            ]
+            heapq.heapify(EXPIRY_HEAP)
+
+
+def clear_cache():
+    global CACHE_BYTES
+    with CACHE_LOCK:
+        CACHE.clear()
+        EXPIRY_HEAP.clear()
+        PREFETCH_FAILED.clear()
+        CACHE_BYTES = 0
 
-    cache_key = f"{username}:{page}:{per_page}"
-    cached = get_cached(cache_key)
-    if cached:
-        response = jsonify(cached)
-        response.headers['X-Cache'] = 'HIT'
-        return response
 
-    response = requests.get(
-        f"{GITHUB_API_URL}/users/{username}/gists",
-        params={"page": page, "per_page": per_page}
+def shared_key(key):
+    # Local keys are (username, page, per_page) tuples; Redis needs a string.
+    # v2: values are hashes (data/etag/has_next), no longer plain strings.
+    return "gists:v2:%s:%d:%d" % key
+
+
+def get_shared(key):
+    """Return (payload, etag, has_next, ttl_seconds) from Redis, or None."""
+    if REDIS is None:
+        return None
+    try:
+        with REDIS.pipeline() as pipe:
+            pipe.hgetall(shared_key(key))
+            pipe.pttl(shared_key(key))
+            fields, pttl = pipe.execute()
+    except redis.RedisError:
+        app.logger.warning("Redis GET failed for %s", key, exc_info=True)
+        return None
+    if not fields:
+        return None
+    return (
+        fields[b"data"],
+        fields.get(b"etag", b"").decode() or None,
+        fields.get(b"has_next") == b"1",
+        # Keep the remaining shared TTL so L1 never outlives L2's copy.
+        CACHE_TTL if pttl == -1 else pttl / 1000,
     )
 
+
+def set_shared(key, payload, etag, has_next):
+    if REDIS is None:
+        return
+    try:
+        with REDIS.pipeline() as pipe:
+            pipe.hset(shared_key(key), mapping={
+                "data": payload,
+                "etag": etag or "",
+                "has_next": "1" if has_next else "0",
+            })
+            pipe.expire(shared_key(key), CACHE_TTL)
+            pipe.execute()
+    except redis.RedisError:
+        app.logger.warning("Redis SET failed for %s", key, exc_info=True)
+
+
+def get_or_set(key, loader):
+    """Return (data, hit) for key, calling loader at most once per key.
+
+    loader receives the expired entry for key (or None) so it can
+    revalidate it, and returns (data, etag, has_next, ttl); ttl None means
+    CACHE_TTL. Concurrent misses on the same key wait for the first
+    caller's fetch instead of each hitting GitHub.
+    """
+    data = get_cached(key)
+    if data is not None:
+        return data, True
+
+    with CACHE_LOCK:
+        future = INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            # Re-check: a fetch for this key may have just finished.
+            entry = CACHE.get(key)
+            if entry is not None and CLOCK() < entry.expires_at:
+                return entry.data, True
+            future = INFLIGHT[key] = Future()
+
+    if not leader:
+        try:
+            return future.result(timeout=INFLIGHT_WAIT_TIMEOUT), False
+        except FutureTimeoutError:
+            raise GitHubError("GitHub API timeout", 504)
+
+    try:
+        try:
+            data, etag, has_next, ttl = loader(entry)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        # Release waiters before touching the cache, so a failure there can
+        # never leave them blocked on an unresolved future.
+        future.set_result(data)
+        set_cache(key, data, etag, has_next, ttl)
+        return data, False
+    finally:
+        with CACHE_LOCK:
+            del INFLIGHT[key]
+
+
+def record_rate_limit(response):
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if remaining is not None and reset is not None:
+        RATE_LIMIT["remaining"] = int(remaining)
+        RATE_LIMIT["reset"] = int(reset)
+
+
+def rate_limit_wait():
+    """Seconds until GitHub will accept requests again, or 0 if it will now."""
+    if RATE_LIMIT["remaining"] == 0:
+        return max(0, RATE_LIMIT["reset"] - int(time.time()))
+    return 0
+
+
+def retry_after_seconds(response):
+    """Seconds to wait per Retry-After (delta or HTTP-date) or quota reset."""
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return math.ceil(GITHUB_RETRY.parse_retry_after(value))
+        except InvalidHeader:
+            pass
+    return rate_limit_wait()
+
+
+def fetch_gists(username, page, per_page, etag=None):
+    """Return (body, etag, has_next); body is None if etag is still current.
+
+    body is GitHub's JSON bytes as received. Nothing here reads individual
+    gists, so decoding them into Python objects would only be re-encoded.
+    """
+    # Fail fast while the quota is exhausted instead of spending a request
+    # that GitHub is guaranteed to reject.
+    wait = rate_limit_wait()
+    if wait:
+        raise GitHubError("GitHub API rate limit exceeded", 429, retry_after=wait)
+
+    try:
+        response = SESSION.get(
+            f"{GITHUB_API_URL}/users/{username}/gists",
+            params={"page": page, "per_page": per_page},
+            headers={"If-None-Match": etag} if etag else None,
+            timeout=GITHUB_TIMEOUT,
+        )
+    except requests.Timeout:
+        raise GitHubError("GitHub API timeout", 504)
+    except requests.RequestException:
+        raise GitHubError("GitHub API unavailable", 502)
+
+    record_rate_limit(response)
+
+    if response.status_code in (403, 429) and (
+        RATE_LIMIT["remaining"] == 0 or "Retry-After" in response.headers
+    ):
+        raise GitHubError(
+            "GitHub API rate limit exceeded",
+            429,
+            retry_after=retry_after_seconds(response),
+        )
+
+    has_next = 'rel="next"' in response.headers.get("Link", "")
+
+    if response.status_code == 304:
+        return None, etag, has_next
+
     if response.status_code == 404:
-        return jsonify({"error": "User not found"}), 404
+        raise GitHubError("User not found", 404)
 
     if response.status_code != 200:
-        return jsonify({"error": "GitHub API error"}), response.status_code
+        raise GitHubError("GitHub API error", response.status_code)
+
+    return response.content, response.headers.get("ETag"), has_next
+
+
+def load_gists(cache_key, username, page, per_page, stale):
+    shared = get_shared(cache_key)
+    if shared is not None:
+        return shared
+
+    payload, etag, has_next = fetch_gists(
+        username, page, per_page, etag=stale.etag if stale else None
+    )
+    if payload is None:
+        # Not modified: keep serving the bytes we already have. A 304 need
+        # not repeat the Link header, so keep what the 200 told us.
+        payload = stale.data
+        has_next = stale.has_next
+    set_shared(cache_key, payload, etag, has_next)
+    return payload, etag, has_next, None
+
+
+def back_off_prefetch(cache_key):
+    now = CLOCK()
+    if len(PREFETCH_FAILED) >= CACHE_MAX_SIZE:
+        for key, retry_at in list(PREFETCH_FAILED.items()):
+            if retry_at <= now:
+                PREFETCH_FAILED.pop(key, None)
+        if len(PREFETCH_FAILED) >= CACHE_MAX_SIZE:
+            PREFETCH_FAILED.clear()
+    PREFETCH_FAILED[cache_key] = now + PREFETCH_BACKOFF
+
+
+def prefetch_wanted(cache_key):
+    entry = CACHE.get(cache_key)
+    if entry is not None and CLOCK() < entry.expires_at:
+        return False
+    # Without this, every hit on the previous page would retry a next page
+    # that keeps failing or can never be cached.
+    return CLOCK() >= PREFETCH_FAILED.get(cache_key, 0)
+
+
+def prefetch_gists(username, page, per_page):
+    """Warm the cache for a page in the background, if quota allows."""
+    cache_key = (username.lower(), page, per_page)
+    remaining = RATE_LIMIT["remaining"]
+    if remaining is not None and remaining < PREFETCH_MIN_REMAINING:
+        return
+    with CACHE_LOCK:
+        # Registered at submit time, not when run() starts: while the
+        # workers are busy, hits would otherwise queue one task per request.
+        if (
+            cache_key in INFLIGHT
+            or cache_key in PREFETCH_PENDING
+            or len(PREFETCH_PENDING) >= PREFETCH_MAX_PENDING
+            or not prefetch_wanted(cache_key)
+        ):
+            return
+        PREFETCH_PENDING.add(cache_key)
+
+    def run():
+        try:
+            # The page may have been cached or failed while queued.
+            if not prefetch_wanted(cache_key):
+                return
+            try:
+                get_or_set(
+                    cache_key,
+                    lambda stale: load_gists(cache_key, username, page, per_page, stale),
+                )
+            except GitHubError:
+                pass  # best effort; a real request will surface the error
+            if cache_key in CACHE:
+                PREFETCH_FAILED.pop(cache_key, None)
+            else:
+                back_off_prefetch(cache_key)
+        finally:
+            with CACHE_LOCK:
+                PREFETCH_PENDING.discard(cache_key)
+
+    PREFETCH_EXECUTOR.submit(run)
+
+
+@app.route("/<username>")
+def get_user_gists(username):
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 30, type=int)
+
+    cache_key = (username.lower(), page, per_page)
+    try:
+        payload, hit = get_or_set(
+            cache_key,
+            lambda stale: load_gists(cache_key, username, page, per_page, stale),
+        )
+    except GitHubError as e:
+        response = jsonify({"error": e.message})
+        response.status_code = e.status_code
+        if e.retry_after is not None:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response
+
+    if hit:
+        # Clients paging through gists usually ask for the next page next.
+        entry = CACHE.get(cache_key)
+        if entry is not None and entry.has_next:
+            prefetch_gists(username, page + 1, per_page)
 
-    data = response.json()
-    set_cache(cache_key, data)
-    return jsonify(data)
+    response = app.response_class(payload, mimetype="application/json")
+    response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
 
 
 if __name__ == "__main__":
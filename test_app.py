@@ -1,96 +1,672 @@
+import orjson
 import pytest
+import redis
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, Mock
-from app import app, CACHE
-
-
-@pytest.fixture
+from urllib.parse import urlparse
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+import app as app_module
+from app import (
+    app, CACHE, CACHE_STALE_TTL, CACHE_TTL, GITHUB_API_URL, GITHUB_RETRY,
+    GITHUB_RETRY_AFTER_MAX, GITHUB_TIMEOUT, GitHubAdapter,
+    PREFETCH_BACKOFF, RATE_LIMIT, SESSION, SSL_CONTEXT, clear_cache, get_or_set,
+)
+
+
+@pytest.fixture(scope="session")
 def client():
     app.config["TESTING"] = True
-    CACHE.clear()
     with app.test_client() as client:
         yield client
 
 
-def test_get_user_gists_success(client):
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+
+
+def github_response(status, body=None, headers=None):
+    return Mock(
+        status_code=status,
+        headers=headers or {},
+        content=orjson.dumps(body) if body is not None else b"",
+    )
+
+
+@pytest.fixture
+def mock_get():
+    with patch("app.SESSION.get") as mock_get:
+        yield mock_get
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr("app.CLOCK", fake)
+    return fake
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.calls += 1
+        self.send_response(self.server.status)
+        for name, value in self.server.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    """A local HTTP server behind a session using the real retry policy."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+    server.calls, server.status, server.headers = 0, 200, {}
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    session = requests.Session()
+    session.mount("http://", GitHubAdapter(max_retries=GITHUB_RETRY))
+    server.get = lambda: session.get("http://%s:%d/" % server.server_address)
+    yield server
+    session.close()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("urllib3.util.retry.time.sleep", sleeps.append)
+    return sleeps
+
+
+@pytest.mark.parametrize("status, headers, calls, sleep_ranges", [
+    (429, {"Retry-After": "60"}, 1, []),  # too long to wait: fail fast
+    (429, {"Retry-After": "2"}, 4, [(2, 2)] * 3),
+    # No Retry-After: 0.3 * 2**(n-1) plus up to 0.5s of jitter; urllib3
+    # does not sleep before the first retry.
+    (503, {}, 4, [(0.6, 1.1), (1.2, 1.7)]),
+])
+def test_github_retry_policy(upstream, sleeps, status, headers, calls, sleep_ranges):
+    upstream.status, upstream.headers = status, headers
+
+    response = upstream.get()
+
+    assert response.status_code == status
+    assert upstream.calls == calls
+    assert len(sleeps) == len(sleep_ranges)
+    for slept, (low, high) in zip(sleeps, sleep_ranges):
+        assert low <= slept <= high
+
+
+def test_get_user_gists_success(client, mock_get):
     mock_gists = [{"id": "123", "description": "Test gist"}]
 
-    with patch("app.requests.get") as mock_get:
-        mock_get.return_value = Mock(status_code=200, json=lambda: mock_gists)
-        response = client.get("/octocat")
+    mock_get.return_value = github_response(200, mock_gists)
+    response = client.get("/octocat")
 
     assert response.status_code == 200
     assert response.json == mock_gists
 
 
-def test_get_user_gists_not_found(client):
-    with patch("app.requests.get") as mock_get:
-        mock_get.return_value = Mock(status_code=404)
-        response = client.get("/nonexistent-user-12345")
+def test_github_connections_share_ssl_context():
+    adapter = SESSION.adapters["https://"]
+    pool = adapter.poolmanager.connection_from_url(GITHUB_API_URL)
+    adapter.cert_verify(pool, GITHUB_API_URL, True, None)
+
+    assert pool.conn_kw["ssl_context"] is SSL_CONTEXT
+    assert pool.ca_certs is None
+
+
+@pytest.mark.parametrize("upstream, expected_status, expected_error", [
+    (github_response(404), 404, "User not found"),
+    (github_response(500), 500, "GitHub API error"),
+    (
+        github_response(403, headers={"X-RateLimit-Remaining": "42", "X-RateLimit-Reset": "0"}),
+        403,
+        "GitHub API error",
+    ),
+    (
+        github_response(429, headers={"Retry-After": "30"}),
+        429,
+        "GitHub API rate limit exceeded",
+    ),
+    (
+        github_response(429, headers={"Retry-After": formatdate(time.time() + 30, usegmt=True)}),
+        429,
+        "GitHub API rate limit exceeded",
+    ),
+    (
+        github_response(429, headers={"Retry-After": "soon"}),
+        429,
+        "GitHub API rate limit exceeded",
+    ),
+    (requests.Timeout(), 504, "GitHub API timeout"),
+    (requests.ConnectionError(), 502, "GitHub API unavailable"),
+])
+def test_get_user_gists_error_paths(
+    client, mock_get, monkeypatch, upstream, expected_status, expected_error
+):
+    monkeypatch.setitem(RATE_LIMIT, "remaining", None)
+    if isinstance(upstream, Exception):
+        mock_get.side_effect = upstream
+    else:
+        mock_get.return_value = upstream
+
+    response = client.get("/octocat")
+
+    assert response.status_code == expected_status
+    assert response.json["error"] == expected_error
 
-    assert response.status_code == 404
-    assert response.json["error"] == "User not found"
 
+def test_exhausted_quota_fails_fast(client, mock_get, monkeypatch):
+    monkeypatch.setitem(RATE_LIMIT, "remaining", None)
+    reset = int(time.time()) + 60
 
-def test_get_user_gists_api_error(client):
-    with patch("app.requests.get") as mock_get:
-        mock_get.return_value = Mock(status_code=500)
-        response = client.get("/octocat")
+    mock_get.return_value = github_response(403, headers={
+        "X-RateLimit-Remaining": "0",
+        "X-RateLimit-Reset": str(reset),
+    })
+    response = client.get("/octocat")
+
+    assert response.status_code == 429
+    assert response.json["error"] == "GitHub API rate limit exceeded"
+    assert 0 < int(response.headers["Retry-After"]) <= 60
 
-    assert response.status_code == 500
-    assert response.json["error"] == "GitHub API error"
+    # Quota is known to be exhausted, so GitHub is not called again.
+    response = client.get("/hubot")
+    assert response.status_code == 429
+    assert mock_get.call_count == 1
 
 
-def test_pagination(client):
+def test_pagination(client, mock_get):
     mock_gists = [{"id": "456"}]
 
-    with patch("app.requests.get") as mock_get:
-        mock_get.return_value = Mock(status_code=200, json=lambda: mock_gists)
-        response = client.get("/octocat?page=2&per_page=10")
+    mock_get.return_value = github_response(200, mock_gists)
+    response = client.get("/octocat?page=2&per_page=10")
 
-        mock_get.assert_called_once()
-        call_args = mock_get.call_args
-        assert call_args[1]["params"]["page"] == 2
-        assert call_args[1]["params"]["per_page"] == 10
+    mock_get.assert_called_once()
+    call_args = mock_get.call_args
+    assert call_args[1]["params"]["page"] == 2
+    assert call_args[1]["params"]["per_page"] == 10
+    assert call_args[1]["timeout"] == GITHUB_TIMEOUT
 
     assert response.status_code == 200
 
 
-def test_caching(client):
+def test_caching(client, mock_get):
     mock_gists = [{"id": "789"}]
 
-    with patch("app.requests.get") as mock_get:
-        mock_get.return_value = Mock(status_code=200, json=lambda: mock_gists)
+    mock_get.return_value = github_response(200, mock_gists)
+    # First request - hits GitHub
+    response1 = client.get("/testuser")
+    assert response1.status_code == 200
+    assert response1.headers["X-Cache"] == "MISS"
+    assert mock_get.call_count == 1
+
+    # Second request - served from cache
+    response2 = client.get("/testuser")
+    assert response2.status_code == 200
+    assert response2.headers["X-Cache"] == "HIT"
+    assert response2.mimetype == "application/json"
+    assert mock_get.call_count == 1  # Still 1, cache hit
+
+    assert response1.json == response2.json
+
+
+@pytest.mark.parametrize("first, second, expected_calls", [
+    ("/user1?page=1&per_page=10", "/user1?page=2&per_page=10", 2),  # different page
+    ("/user1?page=1&per_page=10", "/user1?page=1&per_page=20", 2),  # different size
+    ("/Octocat", "/octocat", 1),  # usernames are case-insensitive
+])
+def test_cache_key(client, mock_get, first, second, expected_calls):
+    mock_get.return_value = github_response(200, [{"id": "abc"}])
+
+    client.get(first)
+    client.get(second)
+
+    assert mock_get.call_count == expected_calls
+
+
+def test_concurrent_misses_share_one_fetch(client):
+    release = threading.Event()
+    calls = []
+
+    def loader(stale):
+        calls.append(1)
+        release.wait(timeout=5)
+        return [{"id": "1"}], None, False, None
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(get_or_set, ("octocat", 1, 30), loader) for _ in range(8)]
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert len(calls) == 1
+    assert all(data == [{"id": "1"}] for data, _ in results)
+
+
+def test_waiters_released_when_caching_fails(client, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader(stale):
+        started.set()
+        release.wait(timeout=5)
+        return [{"id": "1"}], None, False, None
+
+    def broken_set_cache(*args):
+        raise RuntimeError("cache unavailable")
+
+    monkeypatch.setattr("app.set_cache", broken_set_cache)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(get_or_set, ("octocat", 1, 30), loader)
+        started.wait(timeout=5)
+        # What a concurrent request for the same key would wait on.
+        waiter = app_module.INFLIGHT[("octocat", 1, 30)]
+        release.set()
+
+        with pytest.raises(RuntimeError):
+            leader.result(timeout=5)
+    assert waiter.result(timeout=5) == [{"id": "1"}]
+    assert ("octocat", 1, 30) not in app_module.INFLIGHT
+
+
+def test_cache_expiration(client, mock_get, clock):
+    mock_get.return_value = github_response(200, [{"id": "1"}])
+
+    client.get("/testuser")
+    clock.advance(CACHE_TTL - 1)
+    client.get("/testuser")  # still fresh
+    assert mock_get.call_count == 1
+
+    clock.advance(1)
+    client.get("/testuser")  # expired, refetched
+    assert mock_get.call_count == 2
+
+
+def test_expired_entry_revalidated_with_etag(client, mock_get, clock):
+    mock_get.return_value = github_response(200, [{"id": "1"}], {"ETag": 'W/"abc"'})
+    client.get("/testuser")
+    assert mock_get.call_args[1]["headers"] is None
+
+    clock.advance(CACHE_TTL)
+    mock_get.return_value = github_response(304, headers={"ETag": 'W/"abc"'})
+    response = client.get("/testuser")
+
+    assert mock_get.call_args[1]["headers"] == {"If-None-Match": 'W/"abc"'}
+    assert response.status_code == 200
+    assert response.json == [{"id": "1"}]
+
+
+NEXT_PAGE_LINK = {"Link": '<https://api.github.com/user/1/gists?page=2>; rel="next"'}
+
+
+class InlineExecutor:
+    def submit(self, fn):
+        fn()
+
+
+def test_cache_hit_prefetches_next_page(client, mock_get, monkeypatch):
+    monkeypatch.setattr("app.PREFETCH_EXECUTOR", InlineExecutor())
+
+    mock_get.return_value = github_response(200, [{"id": "1"}], NEXT_PAGE_LINK)
+    client.get("/octocat?page=1&per_page=10")
+    assert mock_get.call_count == 1
+
+    # Page 2 is the last one.
+    mock_get.return_value = github_response(200, [{"id": "2"}])
+    client.get("/octocat?page=1&per_page=10")  # hit, prefetches page 2
+    assert mock_get.call_count == 2
+    assert mock_get.call_args[1]["params"] == {"page": 2, "per_page": 10}
+
+    response = client.get("/octocat?page=2&per_page=10")
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.json == [{"id": "2"}]
+    assert mock_get.call_count == 2
+
+
+@pytest.mark.parametrize("next_page", [
+    github_response(500),
+    github_response(200, [{"id": "x" * 50}]),  # over CACHE_MAX_ENTRY_BYTES
+])
+def test_failed_prefetch_backs_off(client, mock_get, monkeypatch, clock, next_page):
+    monkeypatch.setattr("app.PREFETCH_EXECUTOR", InlineExecutor())
+    monkeypatch.setattr("app.CACHE_MAX_ENTRY_BYTES", 30)
+
+    mock_get.return_value = github_response(200, [{"id": "1"}], NEXT_PAGE_LINK)
+    client.get("/octocat")
+
+    mock_get.return_value = next_page
+    for _ in range(10):
+        client.get("/octocat")
+    assert mock_get.call_count == 2  # page 1, then one attempt at page 2
+
+    clock.advance(PREFETCH_BACKOFF)
+    client.get("/octocat")
+    assert mock_get.call_count == 3
+
+
+def test_queued_prefetches_share_one_fetch(client, mock_get, monkeypatch):
+    # A real executor: InlineExecutor runs each task before the next hit.
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr("app.PREFETCH_EXECUTOR", executor)
+    release = threading.Event()
+    executor.submit(release.wait, 5)  # keep the worker busy while hits pile up
 
-        # First request - hits GitHub
-        response1 = client.get("/testuser")
-        assert response1.status_code == 200
-        assert mock_get.call_count == 1
+    def fake_get(url, params, **kwargs):
+        if params["page"] == 1:
+            return github_response(200, [{"id": "1"}], NEXT_PAGE_LINK)
+        return github_response(500)
 
-        # Second request - served from cache
-        response2 = client.get("/testuser")
-        assert response2.status_code == 200
-        assert mock_get.call_count == 1  # Still 1, cache hit
+    mock_get.side_effect = fake_get
+    for _ in range(20):
+        client.get("/carol")
+    release.set()
+    executor.shutdown(wait=True)
 
-        assert response1.json == response2.json
+    pages = [call[1]["params"]["page"] for call in mock_get.call_args_list]
+    assert pages == [1, 2]
+    assert not app_module.PREFETCH_PENDING
 
 
-def test_cache_key_includes_pagination(client):
-    mock_gists = [{"id": "abc"}]
+def test_revalidation_keeps_next_page_link(client, mock_get, clock):
+    headers = {"ETag": '"abc"', **NEXT_PAGE_LINK}
+    mock_get.return_value = github_response(200, [{"id": "1"}], headers)
+    client.get("/octocat")
 
-    with patch("app.requests.get") as mock_get:
-        mock_get.return_value = Mock(status_code=200, json=lambda: mock_gists)
+    clock.advance(CACHE_TTL)
+    mock_get.return_value = github_response(304, headers={"ETag": '"abc"'})
+    client.get("/octocat")
 
-        client.get("/user1?page=1&per_page=10")
-        client.get("/user1?page=2&per_page=10")  # Different page
+    assert CACHE[("octocat", 1, 30)].has_next
 
-        assert mock_get.call_count == 2  # Both hit GitHub
+
+def test_prefetch_skipped_when_quota_low(client, mock_get, monkeypatch):
+    monkeypatch.setattr("app.PREFETCH_EXECUTOR", InlineExecutor())
+    monkeypatch.setitem(RATE_LIMIT, "remaining", 5)
+
+    mock_get.return_value = github_response(200, [{"id": "1"}], NEXT_PAGE_LINK)
+    client.get("/octocat")
+    client.get("/octocat")
+
+    assert mock_get.call_count == 1
+
+
+def test_dead_entries_purged_on_insert(client, mock_get, clock):
+    mock_get.return_value = github_response(200, [])
+    client.get("/alice")
+    clock.advance(CACHE_TTL + CACHE_STALE_TTL)
+    client.get("/bob")
+
+    assert list(CACHE) == [("bob", 1, 30)]
+
+
+def test_expiry_heap_tracks_cache_size(client, mock_get, monkeypatch):
+    monkeypatch.setattr("app.CACHE_MAX_SIZE", 2)
+    monkeypatch.setattr("app.CACHE_PURGE_BATCH", 4)
+
+    mock_get.return_value = github_response(200, [])
+    for i in range(20):
+        client.get(f"/user{i}")  # each insert evicts the oldest entry
+
+    assert len(CACHE) == 2
+    assert len(app_module.EXPIRY_HEAP) <= 2 * len(CACHE) + 4
+
+
+def test_cache_evicts_least_recently_used(client, mock_get, monkeypatch):
+    monkeypatch.setattr("app.CACHE_MAX_SIZE", 2)
+
+    mock_get.return_value = github_response(200, [{"id": "1"}])
+
+    client.get("/alice")
+    client.get("/bob")
+    client.get("/alice")  # refreshes alice, bob is now oldest
+    client.get("/carol")  # evicts bob
+    assert mock_get.call_count == 3
+
+    client.get("/alice")
+    assert mock_get.call_count == 3
+    client.get("/bob")
+    assert mock_get.call_count == 4
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for the shared cache: hashes with a TTL."""
+
+    def __init__(self, clock=None):
+        self.clock = clock or FakeClock()
+        self.store = {}
+        self.expires = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def hset(self, key, mapping):
+        encode = lambda v: v if isinstance(v, bytes) else str(v).encode()
+        self.store[key] = {encode(k): encode(v) for k, v in mapping.items()}
+
+    def expire(self, key, seconds):
+        self.expires[key] = self.clock() + seconds
+
+    def hgetall(self, key):
+        return self.store.get(key, {})
+
+    def pttl(self, key):
+        if key not in self.store:
+            return -2
+        if key not in self.expires:
+            return -1
+        return int((self.expires[key] - self.clock()) * 1000)
+
+
+class FakePipeline:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+        return lambda *args, **kwargs: self.calls.append((method, args, kwargs))
+
+    def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+def test_shared_cache_populated_on_miss(client, mock_get, monkeypatch):
+    fake_redis = FakeRedis()
+    monkeypatch.setattr("app.REDIS", fake_redis)
+
+    mock_get.return_value = github_response(
+        200, [{"id": "1"}], headers={"ETag": '"abc"'}
+    )
+    client.get("/octocat")
+
+    stored = fake_redis.store["gists:v2:octocat:1:30"]
+    assert orjson.loads(stored[b"data"]) == [{"id": "1"}]
+    assert stored[b"etag"] == b'"abc"'
+    assert fake_redis.pttl("gists:v2:octocat:1:30") == CACHE_TTL * 1000
+
+
+def test_shared_cache_hit_skips_github(client, mock_get, monkeypatch):
+    fake_redis = FakeRedis()
+    fake_redis.hset("gists:v2:octocat:1:30", mapping={
+        "data": orjson.dumps([{"id": "shared"}]), "etag": "", "has_next": "0",
+    })
+    monkeypatch.setattr("app.REDIS", fake_redis)
+
+    response = client.get("/octocat")
+    mock_get.assert_not_called()
+
+    assert response.json == [{"id": "shared"}]
+
+
+def test_shared_cache_hit_keeps_etag_and_remaining_ttl(client, mock_get, clock, monkeypatch):
+    fake_redis = FakeRedis(clock)
+    fake_redis.hset("gists:v2:octocat:1:30", mapping={
+        "data": b"[]", "etag": '"abc"', "has_next": "1",
+    })
+    fake_redis.expire("gists:v2:octocat:1:30", 40)
+    monkeypatch.setattr("app.REDIS", fake_redis)
+
+    client.get("/octocat")
+
+    entry = CACHE[("octocat", 1, 30)]
+    assert entry.etag == '"abc"'
+    assert entry.has_next is True
+    assert entry.expires_at == clock() + 40
+
+
+def test_shared_cache_errors_fall_back_to_github(client, mock_get, monkeypatch):
+    broken_redis = Mock()
+    broken_redis.pipeline.side_effect = redis.ConnectionError()
+    monkeypatch.setattr("app.REDIS", broken_redis)
+
+    mock_get.return_value = github_response(200, [{"id": "1"}])
+    response = client.get("/octocat")
+
+    assert response.status_code == 200
+    assert response.json == [{"id": "1"}]
+
+
+def test_cache_evicts_by_total_bytes(client, mock_get, monkeypatch):
+    monkeypatch.setattr("app.CACHE_MAX_BYTES", 30)
+    body = orjson.dumps([{"id": "x" * 4}])  # 15 bytes
+
+    mock_get.return_value = github_response(200, [{"id": "x" * 4}])
+    client.get("/alice")
+    client.get("/bob")
+    client.get("/carol")  # evicts alice to stay within 30 bytes
+
+    assert list(CACHE) == [("bob", 1, 30), ("carol", 1, 30)]
+    assert app_module.CACHE_BYTES == 2 * len(body)
+
+
+def test_oversized_entry_not_cached(client, mock_get, monkeypatch):
+    monkeypatch.setattr("app.CACHE_MAX_ENTRY_BYTES", 10)
+
+    mock_get.return_value = github_response(200, [{"id": "big"}])
+    response = client.get("/octocat")
+
+    assert response.json == [{"id": "big"}]
+    assert len(CACHE) == 0
+    assert app_module.CACHE_BYTES == 0
+
+
+SAMPLE_GIST = {
+    "id": "aa5a315d61ae9438b18d",
+    "description": "Hello World Examples",
+    "html_url": "https://gist.github.com/octocat/aa5a315d61ae9438b18d",
+    "files": {"hello_world.rb": {"filename": "hello_world.rb", "language": "Ruby"}},
+}
+
+
+class FakeGitHubAdapter(BaseAdapter):
+    """Answers SESSION requests in-process with canned GitHub responses."""
+
+    NOT_FOUND = (404, orjson.dumps({"message": "Not Found"}))
+
+    def __init__(self, routes):
+        super().__init__()
+        # URL path -> (status, encoded body); bodies are encoded once here
+        # rather than on every request.
+        self.routes = {
+            path: (status, orjson.dumps(body)) for path, (status, body) in routes.items()
+        }
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        status, content = self.routes.get(urlparse(request.url).path, self.NOT_FOUND)
+        response = requests.Response()
+        response.status_code = status
+        response._content = content
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope="session")
+def github_transport():
+    # Built once: the routes are encoded up front, so the adapter is reusable.
+    return FakeGitHubAdapter({"/users/octocat/gists": (200, [SAMPLE_GIST])})
+
+
+@pytest.fixture
+def fake_github(github_transport, monkeypatch):
+    # Mounted per test, not per session: a session-wide mount would leave the
+    # fake in front of the real adapter for every later test. mount() rather
+    # than setitem(), since SESSION uses the first matching prefix and mount()
+    # moves longer prefixes first; the copy lets monkeypatch undo it.
+    monkeypatch.setattr(SESSION, "adapters", SESSION.adapters.copy())
+    SESSION.mount(GITHUB_API_URL, github_transport)
+    github_transport.requests.clear()
+    return github_transport
+
+
+def test_get_octocat_gists(client, fake_github):
+    response = client.get("/octocat")
+
+    assert response.status_code == 200
+    assert response.json == [SAMPLE_GIST]
+    assert fake_github.requests[0].url == f"{GITHUB_API_URL}/users/octocat/gists?page=1&per_page=30"
+
+
+def test_caching_behavior(client, fake_github):
+    first = client.get("/octocat")
+    second = client.get("/octocat")
+
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.json == first.json
+    assert len(fake_github.requests) == 1
+
+
+def test_nonexistent_user(client, fake_github):
+    response = client.get("/nonexistent-user-12345")
+
+    assert response.status_code == 404
+    assert response.json["error"] == "User not found"
 
 
+@pytest.mark.live
 def test_get_octocat_gists_real_api(client):
     """Integration test with real GitHub API."""
     response = client.get("/octocat")
 
-    if response.status_code == 403:
+    if response.status_code == 429:
         pytest.skip("GitHub rate limit exceeded")
 
     assert response.status_code == 200